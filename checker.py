@@ -1,18 +1,67 @@
 #!/usr/bin/env python3
 import argparse
+import base64
 import concurrent.futures as cf
+import contextlib
 import csv
+import functools
 import hashlib
+import http.client
+import itertools
 import os
+import queue
 import re
+import socket
+import sqlite3
 import sys
+import threading
 import time
-import urllib.request
 import urllib.error
-from urllib.parse import urlparse
+import urllib.request
+import zlib
+from collections import OrderedDict
+from urllib.parse import unquote, urljoin, urlsplit
 
 DEFAULT_TIMEOUT = 12
 
+# Sent with every request; built once rather than per call (http.client doesn't mutate it)
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (JS-URL-Checker)",
+    "Accept": "*/*",
+}
+
+MAX_REDIRECTS = 10
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# Bodies up to this size are drained on release so the socket can be reused
+DRAIN_LIMIT = 64 * 1024
+# Idle keep-alive connections kept per worker thread; the least recently used
+# one is closed beyond this, so open sockets stay bounded at workers * POOL_SIZE
+POOL_SIZE = 8
+# Liveness probes fetch only this many bytes: enough to sniff for HTML
+PROBE_BYTES = 512
+COPY_BUFSIZE = 64 * 1024
+# Content-Encoding -> zlib wbits. Only what the stdlib can decode is advertised.
+DECODERS = {"gzip": 31, "x-gzip": 31, "deflate": 15}
+ACCEPT_ENCODING = "gzip, deflate"
+# URLs per host handed to one worker in a row, so its keep-alive socket is reused
+HOST_BATCH = 8
+# Batches in flight per worker; results are written and dropped as they land,
+# so memory doesn't grow with the number of URLs
+INFLIGHT_PER_WORKER = 4
+# Seconds a resolved host address is reused before asking the resolver again
+DNS_TTL = 300
+# Besides 5xx, statuses worth retrying
+TRANSIENT_CODES = (408, 429)
+# After BREAKER_FAILS transient failures on a host within BREAKER_WINDOW
+# seconds, its remaining URLs fail fast for BREAKER_COOLDOWN seconds
+BREAKER_FAILS = 3
+BREAKER_WINDOW = 10
+BREAKER_COOLDOWN = 30
+# Console output: lines per write, idle seconds before a partial flush, queue bound
+LOG_BATCH = 256
+LOG_IDLE = 0.1
+LOG_QUEUE_SIZE = 10_000
+
 JS_CTYPES = (
     "application/javascript",
     "text/javascript",
@@ -23,135 +72,677 @@ JS_CTYPES = (
 
 HTML_SIGS = (b"<!doctype html", b"<html", b"<head", b"<body")
 
+_JS_CTYPE_SEARCH = re.compile("|".join(map(re.escape, JS_CTYPES + ("javascript",))), re.I).search
+_HTML_SIG_MATCH = re.compile(rb"\s*(?:" + b"|".join(map(re.escape, HTML_SIGS)) + rb")", re.I).match
+_SANITIZE_SUB = re.compile(r"[^\w.\-]+").sub
+
+
+@functools.lru_cache(maxsize=200_000)
+def _url_short_hash(s: str, size: int) -> str:
+    # BLAKE2b emits exactly `size` bytes (2 * size hex chars), nothing to truncate
+    return hashlib.blake2b(s.encode("utf-8"), digest_size=size).hexdigest()
+
 
 def sanitize_filename(name: str) -> str:
-    name = re.sub(r"[^\w.\-]+", "_", name).strip("_")
+    name = _SANITIZE_SUB("_", name).strip("_")
     return name[:180] if name else "file.js"
 
 
+def _split_path_query(url: str):
+    """
+    Cheap stand-in for urlparse() when only the path and query are needed.
+    Returns:
+      path(str), query(str)
+    """
+    rest, _, query = url.partition("#")[0].partition("?")
+    scheme, sep, after = rest.partition("://")
+    if sep and "/" not in scheme:
+        rest = "/" + after.partition("/")[2]
+    elif rest.startswith("//"):
+        rest = "/" + rest[2:].partition("/")[2]
+    return rest, query
+
+
 def filename_from_url(url: str) -> str:
-    p = urlparse(url)
-    base = os.path.basename(p.path.rstrip("/"))
+    path, query = _split_path_query(url)
+    # urlparse() would also split ;params off the last segment
+    base = path.rstrip("/").rpartition("/")[2].partition(";")[0]
     if not base:
-        h = hashlib.sha1(url.encode("utf-8")).hexdigest()[:12]
+        h = _url_short_hash(url, 6)
         base = f"script_{h}.js"
     if not base.lower().endswith(".js"):
         base += ".js"
 
     # If query params exist, add a stable suffix so versions don't collide
-    if p.query:
-        qh = hashlib.sha1(p.query.encode("utf-8")).hexdigest()[:6]
+    if query:
+        qh = _url_short_hash(query, 3)
         root, ext = os.path.splitext(base)
         base = f"{root}_{qh}{ext}"
 
     return sanitize_filename(base)
 
 
-def request_url(url: str, method: str, timeout: int):
-    req = urllib.request.Request(
-        url,
-        method=method,
-        headers={
-            "User-Agent": "Mozilla/5.0 (JS-URL-Checker)",
-            "Accept": "*/*",
-        },
-    )
-    return urllib.request.urlopen(req, timeout=timeout)
+# Resolved addresses shared by all threads: (host, port) -> (expires_at, addrinfo list)
+_dns_cache = {}
+
+
+def _resolve(host: str, port: int):
+    now = time.monotonic()
+    hit = _dns_cache.get((host, port))
+    if hit is not None and hit[0] > now:
+        return hit[1]
+    infos = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)
+    _dns_cache[(host, port)] = (now + DNS_TTL, infos)
+    return infos
+
+
+def _create_connection(address, timeout=None, source_address=None):
+    """
+    socket.create_connection() that resolves through the in-process DNS cache.
+    """
+    host, port = address
+    err = None
+    for af, socktype, proto, _, sa in _resolve(host, port):
+        sock = None
+        try:
+            sock = socket.socket(af, socktype, proto)
+            sock.settimeout(timeout)
+            if source_address:
+                sock.bind(source_address)
+            sock.connect(sa)
+            return sock
+        except OSError as e:
+            err = e
+            if sock is not None:
+                sock.close()
+    raise err if err is not None else OSError(f"getaddrinfo returned no addresses for {host}")
+
+
+@functools.lru_cache(maxsize=None)
+def _proxy_for(scheme: str, host: str):
+    """
+    The proxy urlopen() would use for this host (HTTP(S)_PROXY / NO_PROXY).
+    Returns:
+      (proxy host[:port], headers to send to the proxy) or None
+    """
+    proxy = urllib.request.getproxies().get(scheme)
+    if not proxy or urllib.request.proxy_bypass(host):
+        return None
+    p = urlsplit(proxy if "://" in proxy else "http://" + proxy)
+    headers = {}
+    if p.username is not None:
+        cred = f"{unquote(p.username)}:{unquote(p.password or '')}".encode("utf-8")
+        headers["Proxy-Authorization"] = "Basic " + base64.b64encode(cred).decode("ascii")
+    return p.netloc.rpartition("@")[2], headers
+
+
+# Keep-alive connections, one LRU dict per worker thread: (scheme, netloc) -> connection
+_local = threading.local()
+
+
+def _connection(scheme: str, netloc: str, timeout: int):
+    """
+    Returns:
+      conn, reused(bool)
+    """
+    pool = getattr(_local, "pool", None)
+    if pool is None:
+        pool = _local.pool = OrderedDict()
+    conn = pool.get((scheme, netloc))
+    if conn is not None:
+        pool.move_to_end((scheme, netloc))
+        conn.timeout = timeout
+        if conn.sock is not None:
+            conn.sock.settimeout(timeout)
+        return conn, True
+    cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+    host = netloc.rpartition("@")[2]
+    proxy = _proxy_for(scheme, host)
+    if proxy is None:
+        conn = cls(host, timeout=timeout)
+    else:
+        conn = cls(proxy[0], timeout=timeout)
+        if scheme == "https":
+            # CONNECT through the proxy; TLS is still end-to-end with the host
+            conn.set_tunnel(host, headers=proxy[1])
+    while len(pool) >= POOL_SIZE:
+        pool.popitem(last=False)[1].close()
+    pool[(scheme, netloc)] = conn
+    conn._create_connection = _create_connection
+    return conn, False
+
+
+def _discard(scheme: str, netloc: str, conn):
+    conn.close()
+    pool = getattr(_local, "pool", {})
+    if pool.get((scheme, netloc)) is conn:
+        del pool[(scheme, netloc)]
+
+
+def _send(url: str, method: str, timeout: int, extra_headers=None):
+    p = urlsplit(url)
+    if p.scheme not in ("http", "https") or not p.netloc:
+        raise urllib.error.URLError(f"unknown url type: {url}")
+    path = p.path or "/"
+    if p.query:
+        path += "?" + p.query
+    headers = {**DEFAULT_HEADERS, **extra_headers} if extra_headers else DEFAULT_HEADERS
+    host = p.netloc.rpartition("@")[2]
+    proxy = _proxy_for(p.scheme, host)
+    if proxy is not None and p.scheme == "http":
+        # Plain HTTP proxies take the absolute URL as the request target
+        path = f"http://{host}{path}"
+        headers = {**headers, **proxy[1]}
+
+    conn, reused = _connection(p.scheme, p.netloc, timeout)
+    while True:
+        try:
+            conn.request(method, path, headers=headers)
+            resp = conn.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError) as e:
+            # The server may have dropped an idle keep-alive socket; retry once on a fresh one
+            _discard(p.scheme, p.netloc, conn)
+            if not reused:
+                raise urllib.error.URLError(e)
+            conn, reused = _connection(p.scheme, p.netloc, timeout)
+            continue
+        except (OSError, http.client.HTTPException) as e:
+            _discard(p.scheme, p.netloc, conn)
+            raise urllib.error.URLError(e)
+        except BaseException:
+            # e.g. UnicodeEncodeError for a non-ASCII path: the connection is left
+            # mid-request and must not be handed to the next URL on this host
+            _discard(p.scheme, p.netloc, conn)
+            raise
+        resp.url = url
+        resp.release = lambda: _release(p.scheme, p.netloc, conn, resp)
+        return resp
+
+
+def _release(scheme: str, netloc: str, conn, resp):
+    # A connection can only be reused once the previous body has been fully read
+    if not resp.isclosed():
+        if resp.chunked or resp.length is None or resp.length > DRAIN_LIMIT:
+            _discard(scheme, netloc, conn)
+            return
+        try:
+            resp.read()
+        except (OSError, http.client.HTTPException):
+            _discard(scheme, netloc, conn)
+
+
+def _open(url: str, method: str, timeout: int, extra_headers=None):
+    for _ in range(MAX_REDIRECTS + 1):
+        resp = _send(url, method, timeout, extra_headers)
+        location = resp.getheader("Location")
+        if resp.status in REDIRECT_CODES and location:
+            resp.release()
+            url = urljoin(url, location)
+            continue
+        if resp.status >= 400:
+            resp.release()
+            raise urllib.error.HTTPError(url, resp.status, resp.reason, resp.headers, None)
+        return resp
+    resp.release()
+    raise urllib.error.HTTPError(url, resp.status, "Too many redirects", resp.headers, None)
+
+
+@contextlib.contextmanager
+def request_url(url: str, method: str, timeout: int, extra_headers=None):
+    """
+    Like urlopen(), but reuses a keep-alive connection per host within the
+    calling thread. Raises HTTPError for 4xx/5xx and URLError on I/O errors.
+    """
+    resp = _open(url, method, timeout, extra_headers)
+    try:
+        yield resp
+    finally:
+        resp.release()
 
 
 def looks_like_js_content(ctype: str, url: str) -> bool:
-    c = (ctype or "").lower()
-    if any(x in c for x in JS_CTYPES) or "javascript" in c:
+    if _JS_CTYPE_SEARCH(ctype):
         return True
     # Some servers use octet-stream/text/plain for JS. Allow if URL ends in .js
-    return url.lower().split("?")[0].endswith(".js")
+    return url.partition("?")[0].lower().endswith(".js")
 
 
 def is_probably_html(data_prefix: bytes) -> bool:
-    p = (data_prefix or b"").lstrip().lower()
-    return any(p.startswith(sig) for sig in HTML_SIGS)
+    return _HTML_SIG_MATCH(data_prefix) is not None
 
 
-def is_active_once(url: str, timeout: int, check_js_header: bool):
+class UrlCache:
     """
-    Returns:
-      ok(bool), status(str/int), content_type(str), final_url(str)
+    SQLite store of ETag/Last-Modified validators from earlier runs, so
+    unchanged scripts can be re-checked with a conditional request (304).
+    Entries are loaded into memory up front; updates are written in batches.
     """
-    # HEAD first
-    try:
-        with request_url(url, "HEAD", timeout) as resp:
-            status = getattr(resp, "status", resp.getcode())
-            ctype = resp.headers.get("Content-Type", "") or ""
-            final_url = getattr(resp, "url", url)
 
-            if not (200 <= status < 400):
-                return False, status, ctype, final_url
+    BATCH = 500
+
+    def __init__(self, path: str):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS url_cache("
+            "url TEXT PRIMARY KEY, etag TEXT, lm TEXT, status INT, ctype TEXT, checked_at INT)"
+        )
+        self._entries = {
+            row[0]: row[1:] for row in self._db.execute("SELECT url, etag, lm, ctype FROM url_cache")
+        }
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def get(self, url: str):
+        """
+        Returns:
+          (etag, last_modified, content_type) or None
+        """
+        return self._entries.get(url)
+
+    def put(self, url: str, etag: str, lm: str, status: int, ctype: str):
+        with self._lock:
+            self._pending.append((url, etag, lm, status, ctype, int(time.time())))
+            if len(self._pending) >= self.BATCH:
+                self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._db.executemany("INSERT OR REPLACE INTO url_cache VALUES (?, ?, ?, ?, ?, ?)", self._pending)
+            self._db.commit()
+            self._pending.clear()
+
+    def close(self):
+        with self._lock:
+            self._flush()
+        self._db.close()
+
+
+def _is_transient(exc) -> bool:
+    # Timeouts, resets and truncated reads may clear up; DNS failures, refused
+    # connections, TLS/certificate errors and malformed URLs will not.
+    if isinstance(exc, (socket.timeout, TimeoutError, http.client.IncompleteRead)):
+        return True
+    return isinstance(exc, ConnectionError) and not isinstance(exc, ConnectionRefusedError)
 
-            if check_js_header and not looks_like_js_content(ctype, url):
-                # fallback to GET to confirm
-                raise urllib.error.HTTPError(url, status, "Suspicious content-type", resp.headers, None)
 
-            return True, status, ctype, final_url
+# Per-host circuit breaker: host -> (consecutive transient failures, window start, open until)
+_breakers = {}
+_breakers_lock = threading.Lock()
 
-    except Exception:
-        # Fallback GET
-        try:
-            with request_url(url, "GET", timeout) as resp:
-                status = getattr(resp, "status", resp.getcode())
-                ctype = resp.headers.get("Content-Type", "") or ""
-                final_url = getattr(resp, "url", url)
 
-                if not (200 <= status < 400):
-                    return False, status, ctype, final_url
+def _breaker_open(host: str) -> bool:
+    state = _breakers.get(host)
+    return state is not None and state[2] > time.monotonic()
 
-                if check_js_header and not looks_like_js_content(ctype, url):
-                    return False, f"{status} (non-js content-type)", ctype, final_url
 
-                return True, status, ctype, final_url
+def _breaker_record(host: str, transient_failure: bool):
+    with _breakers_lock:
+        if not transient_failure:
+            # The host answered (even if with a 404), so it isn't down
+            _breakers.pop(host, None)
+            return
+        now = time.monotonic()
+        fails, since, until = _breakers.get(host, (0, now, 0.0))
+        if now - since > BREAKER_WINDOW:
+            fails, since = 0, now
+        fails += 1
+        if fails >= BREAKER_FAILS:
+            fails, since, until = 0, now, now + BREAKER_COOLDOWN
+        _breakers[host] = (fails, since, until)
 
-        except urllib.error.HTTPError as e:
-            return False, f"HTTPError {e.code}", "", url
-        except urllib.error.URLError as e:
-            return False, f"URLError {e.reason}", "", url
-        except Exception as e:
-            return False, f"Error {type(e).__name__}: {e}", "", url
 
+def _probe(url: str, timeout: int, headers: dict):
+    """
+    Returns:
+      status(int), content_type(str), final_url(str), etag, last_modified, prefix(bytes)
+    """
+    with request_url(url, "GET", timeout, headers) as resp:
+        return (resp.status, resp.headers.get("Content-Type", ""), resp.url,
+                resp.headers.get("ETag"), resp.headers.get("Last-Modified"), resp.read(PROBE_BYTES))
 
-def is_active(url: str, timeout: int, check_js_header: bool, retries: int, backoff: float):
+
+def is_active_once(url: str, timeout: int, check_js_header: bool, cache: UrlCache = None):
+    """
+    Returns:
+      ok(bool), status(str/int), content_type(str), final_url(str),
+      transient(bool) -- whether a retry might succeed
+    """
+    headers = {"Range": f"bytes=0-{PROBE_BYTES - 1}"}
+    cached = cache.get(url) if cache is not None else None
+    if cached:
+        etag, lm, _ = cached
+        if etag:
+            headers["If-None-Match"] = etag
+        if lm:
+            headers["If-Modified-Since"] = lm
+
+    # A single ranged GET returns the headers plus a sniffable prefix in one
+    # round-trip; servers that ignore Range just answer 200 with the full body.
+    try:
+        try:
+            probe = _probe(url, timeout, headers)
+        except urllib.error.HTTPError as e:
+            if e.code != 416:
+                raise
+            # An empty script can't satisfy bytes=0-511 but does exist: ask again without Range
+            del headers["Range"]
+            probe = _probe(url, timeout, headers)
+        status, ctype, final_url, etag, lm, prefix = probe
+
+    except urllib.error.HTTPError as e:
+        return False, f"HTTPError {e.code}", "", url, e.code >= 500 or e.code in TRANSIENT_CODES
+    except urllib.error.URLError as e:
+        return False, f"URLError {e.reason}", "", url, _is_transient(e.reason)
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        # Read timeouts/truncated bodies, malformed URLs (bad port, IPv6, IDNA)
+        return False, f"Error {type(e).__name__}: {e}", "", url, _is_transient(e)
+
+    if not (200 <= status < 400):
+        return False, status, ctype, final_url, False
+
+    # Not modified since the cached check: no body to sniff, trust the stored type
+    if status == 304 and cached:
+        ctype = cached[2]
+        if check_js_header and not looks_like_js_content(ctype, url):
+            return False, f"{status} (non-js content-type)", ctype, final_url, False
+        return True, status, ctype, final_url, False
+
+    if check_js_header:
+        if not looks_like_js_content(ctype, url):
+            return False, f"{status} (non-js content-type)", ctype, final_url, False
+        if is_probably_html(prefix):
+            return False, f"{status} (html content)", ctype, final_url, False
+
+    # A later 304 skips the prefix sniff, so only cache bodies that passed it,
+    # whether or not --check-js-header was given on this run
+    if cache is not None and (etag or lm) and not is_probably_html(prefix):
+        cache.put(url, etag, lm, status, ctype)
+
+    return True, status, ctype, final_url, False
+
+
+def is_active(url: str, timeout: int, check_js_header: bool, retries: int, backoff: float,
+              cache: UrlCache = None):
+    """
+    Retries only failures that may clear up (timeouts, resets, 5xx/429),
+    and gives up early on hosts whose circuit breaker is open.
+    """
+    try:
+        host = urlsplit(url).netloc
+    except ValueError:
+        host = ""
     last = None
     for attempt in range(retries + 1):
-        ok, status, ctype, final_url = is_active_once(url, timeout, check_js_header)
+        if _breaker_open(host):
+            return last or (False, "circuit open (host failing)", "", url)
+        ok, status, ctype, final_url, transient = is_active_once(url, timeout, check_js_header, cache)
+        _breaker_record(host, not ok and transient)
         last = (ok, status, ctype, final_url)
-        if ok:
+        if ok or not transient:
             return last
         if attempt < retries:
             time.sleep(backoff * (2 ** attempt))
     return last
 
 
-def download_file(url: str, out_dir: str, timeout: int):
-    os.makedirs(out_dir, exist_ok=True)
+class _SharedReader:
+    """
+    Stand-in socket whose makefile() returns one shared buffered reader, so
+    consecutive HTTPResponse objects parse pipelined answers from the same
+    stream without losing bytes buffered by the previous one.
+    """
+
+    def __init__(self, fp):
+        self._fp = fp
+
+    def makefile(self, mode):
+        return self._fp
+
+
+def pipelined_head(scheme: str, netloc: str, paths, timeout: int):
+    """
+    Writes a HEAD request for every path down one connection before reading
+    any answer (HTTP/1.1 pipelining), then reads the answers in order.
+    Returns:
+      list of (status, headers) per path; None where no answer was read
+    """
+    results = [None] * len(paths)
+    cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+    host = netloc.rpartition("@")[2]
+    try:
+        conn = cls(host, timeout=timeout)
+        conn._create_connection = _create_connection
+    except (http.client.HTTPException, ValueError):
+        return results
+
+    extra = "".join(f"{k}: {v}\r\n" for k, v in DEFAULT_HEADERS.items())
+    try:
+        conn.connect()
+        conn.sock.sendall("".join(
+            f"HEAD {path} HTTP/1.1\r\nHost: {host}\r\n{extra}\r\n" for path in paths
+        ).encode("ascii"))
+        with conn.sock.makefile("rb") as fp:
+            for i in range(len(paths)):
+                resp = http.client.HTTPResponse(_SharedReader(fp), method="HEAD")
+                resp.begin()
+                # Detach so discarding this response doesn't close the shared reader
+                resp.fp = None
+                results[i] = (resp.status, resp.headers)
+                if resp.will_close:
+                    # Server is closing (or won't pipeline): the rest go unanswered
+                    break
+    except (OSError, http.client.HTTPException, ValueError):
+        pass
+    finally:
+        conn.close()
+    return results
+
+
+def probe_pipelined(urls, timeout: int, check_js_header: bool):
+    """
+    Pipelined HEAD pass over a batch of same-host URLs. Only conclusive
+    answers are returned; anything else (errors, redirects, unanswered,
+    content that would need sniffing) is left to is_active().
+    Returns:
+      dict url -> (ok, status, content_type, final_url)
+    """
+    try:
+        parts = [urlsplit(u) for u in urls]
+    except ValueError:
+        return {}
+    scheme, netloc = parts[0][:2]
+    if scheme not in ("http", "https") or any(p[:2] != (scheme, netloc) for p in parts):
+        return {}
+    # Pipelining through a proxy isn't attempted; is_active() handles proxies
+    if _proxy_for(scheme, netloc.rpartition("@")[2]) is not None:
+        return {}
+
+    paths = [(p.path or "/") + (f"?{p.query}" if p.query else "") for p in parts]
+    found = {}
+    for u, head in zip(urls, pipelined_head(scheme, netloc, paths, timeout)):
+        if head is None or not (200 <= head[0] < 300):
+            continue
+        ctype = head[1].get("Content-Type", "")
+        # Without a body there's no HTML sniffing, so the header alone must say JS
+        if check_js_header and not _JS_CTYPE_SEARCH(ctype):
+            continue
+        found[u] = (True, head[0], ctype, u)
+    return found
+
+
+def host_batches(urls, size: int = HOST_BATCH):
+    """
+    Groups URLs by (scheme, host), keeping input order within each host,
+    and yields chunks of at most `size` URLs from the same host.
+    """
+    groups = {}
+    for u in urls:
+        try:
+            key = urlsplit(u)[:2]
+        except ValueError:
+            key = None
+        groups.setdefault(key, []).append(u)
+    for group in groups.values():
+        for i in range(0, len(group), size):
+            yield group[i:i + size]
+
+
+# Guards the shared set of output names while downloads run in parallel
+_names_lock = threading.Lock()
+
+
+def _zlib_wbits(encoding: str, first_chunk: bytes) -> int:
+    wbits = DECODERS[encoding]
+    if encoding == "deflate":
+        # "deflate" should be zlib-wrapped, but many servers send raw DEFLATE;
+        # an invalid zlib header fails on the first two bytes
+        try:
+            zlib.decompressobj(wbits).decompress(first_chunk[:2])
+        except zlib.error:
+            return -zlib.MAX_WBITS
+    return wbits
+
+
+def _iter_body(resp, encoding: str):
+    """
+    Yields the response body in chunks, decoding gzip/deflate on the fly.
+    """
+    encoding = encoding.strip().lower()
+    if encoding in ("", "identity"):
+        encoding = ""
+    elif encoding not in DECODERS:
+        raise ValueError(f"Unsupported Content-Encoding: {encoding}")
+
+    decoder = None
+    while True:
+        chunk = resp.read(COPY_BUFSIZE)
+        if not chunk:
+            break
+        if encoding:
+            if decoder is None:
+                decoder = zlib.decompressobj(_zlib_wbits(encoding, chunk))
+            chunk = decoder.decompress(chunk)
+        if chunk:
+            yield chunk
+    if decoder is not None:
+        tail = decoder.flush()
+        if tail:
+            yield tail
+
+
+def _stream_to_file(body, prefix: bytes, out_path: str) -> int:
+    # Stream the rest straight to disk instead of buffering the whole file
+    try:
+        with open(out_path, "wb") as f:
+            f.write(prefix)
+            for chunk in body:
+                f.write(chunk)
+            return f.tell()
+    except BaseException:
+        # Don't leave a truncated script behind
+        with contextlib.suppress(OSError):
+            os.remove(out_path)
+        raise
+
+
+def download_file(url: str, out_dir: str, timeout: int, existing: set):
+    """
+    `out_dir` must already exist; `existing` holds the file names in it
+    and is updated with the name written. Safe to call from several threads.
+    """
     out_name = filename_from_url(url)
+
+    # Avoid overwriting if exact same filename exists. The name is reserved
+    # before downloading so concurrent workers can't pick the same one.
+    with _names_lock:
+        if out_name in existing:
+            h = _url_short_hash(url, 4)
+            root, ext = os.path.splitext(out_name)
+            out_name = f"{root}_{h}{ext}"
+        existing.add(out_name)
     out_path = os.path.join(out_dir, out_name)
 
-    # Avoid overwriting if exact same filename exists
-    if os.path.exists(out_path):
-        h = hashlib.sha1(url.encode("utf-8")).hexdigest()[:8]
-        root, ext = os.path.splitext(out_name)
-        out_path = os.path.join(out_dir, f"{root}_{h}{ext}")
+    try:
+        # Minified JS compresses well; size reported is the decoded size
+        with request_url(url, "GET", timeout, {"Accept-Encoding": ACCEPT_ENCODING}) as resp:
+            ctype = resp.headers.get("Content-Type", "")
+            body = _iter_body(resp, resp.headers.get("Content-Encoding", ""))
+            prefix = next(body, b"")
+
+            # Basic safety: don't save HTML pages as JS
+            if is_probably_html(prefix):
+                raise ValueError(f"Downloaded content looks like HTML, not JS (Content-Type: {ctype})")
+
+            size = _stream_to_file(body, prefix, out_path)
+    except BaseException:
+        with _names_lock:
+            existing.discard(out_name)
+        raise
 
-    with request_url(url, "GET", timeout) as resp:
-        ctype = resp.headers.get("Content-Type", "") or ""
-        data = resp.read()
+    return out_path, size, ctype
 
-    # Basic safety: don't save HTML pages as JS
-    if is_probably_html(data[:200]):
-        raise ValueError(f"Downloaded content looks like HTML, not JS (Content-Type: {ctype})")
 
-    with open(out_path, "wb") as f:
-        f.write(data)
+def _write_lines(stream, lines):
+    text = "\n".join(lines) + "\n"
+    try:
+        stream.write(text)
+    except UnicodeEncodeError:
+        # Non-ASCII/IDN URLs on an ascii or cp1252 console: escape rather than drop
+        enc = getattr(stream, "encoding", None) or "ascii"
+        stream.write(text.encode(enc, "backslashreplace").decode(enc))
+    stream.flush()
+
 
-    return out_path, len(data), ctype
+def _log_writer(q, stream):
+    """
+    Drains `q` until a None sentinel, writing up to LOG_BATCH lines per
+    write/flush. A partial batch is flushed once the queue goes idle.
+    """
+    buf = []
+    while True:
+        try:
+            line = q.get(timeout=LOG_IDLE) if buf else q.get()
+        except queue.Empty:
+            line = False
+        if line:
+            buf.append(line)
+            if len(buf) < LOG_BATCH:
+                continue
+        if buf and stream is not None:
+            try:
+                _write_lines(stream, buf)
+            except Exception:
+                # e.g. output piped to `head`: keep draining so producers never block
+                stream = None
+        buf.clear()
+        if line is None:
+            return
+
+
+@contextlib.contextmanager
+def batched_log(stream):
+    """
+    Yields a log(line) function backed by a writer thread; all queued lines
+    are written before the block exits. If the writer thread dies, further
+    lines are dropped instead of blocking on the full queue.
+    """
+    q = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    t = threading.Thread(target=_log_writer, args=(q, stream), daemon=True)
+    t.start()
+
+    def log(line):
+        while t.is_alive():
+            try:
+                q.put(line, timeout=LOG_IDLE)
+                return
+            except queue.Full:
+                pass
+
+    try:
+        yield log
+    finally:
+        log(None)
+        t.join()
 
 
 def main():
@@ -166,69 +757,98 @@ def main():
     ap.add_argument("--download", action="store_true", help="Download active JS files.")
     ap.add_argument("--outdir", default="active_js_downloads", help="Download folder (if --download).")
     ap.add_argument("--csv", default="report.csv", help="CSV report file.")
+    ap.add_argument("--pipeline", action="store_true",
+                    help="Pre-check each host batch with pipelined HEAD requests on one connection "
+                         "(opt-in: some servers mishandle pipelining).")
+    ap.add_argument("--cache", default=None,
+                    help="SQLite file of ETag/Last-Modified values; re-runs send conditional requests.")
     args = ap.parse_args()
 
     if not os.path.exists(args.input):
         print(f"[!] Input file not found: {args.input}", file=sys.stderr)
         sys.exit(1)
 
-    urls = []
-    seen = set()
+    # dict.fromkeys de-duplicates in one pass and keeps first-seen order
     with open(args.input, "r", encoding="utf-8", errors="ignore") as f:
-        for line in f:
-            u = line.strip()
-            if not u or u.startswith("#"):
-                continue
-            if u not in seen:
-                seen.add(u)
-                urls.append(u)
+        urls = list(dict.fromkeys(u for u in map(str.strip, f) if u and not u.startswith("#")))
 
     if not urls:
         print("[!] No URLs found in input.")
         sys.exit(0)
 
-    active, inactive = [], []
-    rows = []
+    # Only kept when needed for the download phase; results go to disk as they arrive
+    active = []
+    n_active = n_inactive = 0
+
+    def worker(batch, cache):
+        heads = probe_pipelined(batch, args.timeout, args.check_js_header) if args.pipeline else {}
+        return [
+            (u, *(heads.get(u) or is_active(u, args.timeout, args.check_js_header, args.retries, args.backoff, cache)))
+            for u in batch
+        ]
 
-    def worker(u):
-        ok, status, ctype, final_url = is_active(u, args.timeout, args.check_js_header, args.retries, args.backoff)
-        return u, ok, status, ctype, final_url
+    def fetch(u, existing):
+        # Failures come back as values so one bad file doesn't abort the batch
+        try:
+            return download_file(u, args.outdir, args.timeout, existing), None
+        except Exception as e:
+            return None, e
 
     print(f"[*] Checking {len(urls)} URLs with {args.workers} workers ...")
 
-    with cf.ThreadPoolExecutor(max_workers=args.workers) as ex:
-        for u, ok, status, ctype, final_url in ex.map(worker, urls):
-            rows.append([u, ok, status, ctype, final_url])
-            if ok:
-                active.append(u)
-                print(f"[OK]  {u}  ({status})")
-            else:
-                inactive.append(u)
-                print(f"[BAD] {u}  ({status})")
-
-    with open("active_js_urls.txt", "w", encoding="utf-8") as f:
-        f.write("\n".join(active) + ("\n" if active else ""))
-    with open("inactive_js_urls.txt", "w", encoding="utf-8") as f:
-        f.write("\n".join(inactive) + ("\n" if inactive else ""))
-
-    with open(args.csv, "w", encoding="utf-8", newline="") as f:
-        w = csv.writer(f)
-        w.writerow(["url", "active", "status", "content_type", "final_url"])
-        w.writerows(rows)
-
-    print("\n[*] Saved:")
-    print(f"    active_js_urls.txt   ({len(active)})")
-    print(f"    inactive_js_urls.txt ({len(inactive)})")
-    print(f"    {args.csv} ({len(rows)} rows)")
-
-    if args.download and active:
-        print(f"\n[*] Downloading {len(active)} active files to: {args.outdir}")
-        for u in active:
-            try:
-                path, size, ctype = download_file(u, args.outdir, args.timeout)
-                print(f"[DL] {u} -> {path} ({size} bytes, {ctype})")
-            except Exception as e:
-                print(f"[DL-FAIL] {u} -> {e}")
+    # One pool serves both phases, so downloads reuse the workers' keep-alive
+    # connections; console lines go through a batching background writer so
+    # the result loop never blocks on the terminal.
+    with batched_log(sys.stdout) as log, cf.ThreadPoolExecutor(max_workers=args.workers) as ex:
+        with contextlib.ExitStack() as stack:
+            act_f = stack.enter_context(open("active_js_urls.txt", "w", encoding="utf-8"))
+            inact_f = stack.enter_context(open("inactive_js_urls.txt", "w", encoding="utf-8"))
+            w = csv.writer(stack.enter_context(open(args.csv, "w", encoding="utf-8", newline="")))
+            w.writerow(["url", "active", "status", "content_type", "final_url"])
+
+            # Closed once every check below has finished, flushing pending entries
+            cache = UrlCache(args.cache) if args.cache else None
+            if cache is not None:
+                stack.callback(cache.close)
+
+            # Report each result as soon as it lands instead of in input order,
+            # so one slow host doesn't hold back everything queued behind it.
+            batches = host_batches(urls)
+            pending = {ex.submit(worker, batch, cache)
+                       for batch in itertools.islice(batches, INFLIGHT_PER_WORKER * args.workers)}
+            while pending:
+                done, pending = cf.wait(pending, return_when=cf.FIRST_COMPLETED)
+                pending.update(ex.submit(worker, batch, cache) for batch in itertools.islice(batches, len(done)))
+                for u, ok, status, ctype, final_url in itertools.chain.from_iterable(f.result() for f in done):
+                    w.writerow([u, ok, status, ctype, final_url])
+                    if ok:
+                        n_active += 1
+                        act_f.write(u + "\n")
+                        if args.download:
+                            active.append(u)
+                        log(f"[OK]  {u}  ({status})")
+                    else:
+                        n_inactive += 1
+                        inact_f.write(u + "\n")
+                        log(f"[BAD] {u}  ({status})")
+
+        log("\n[*] Saved:")
+        log(f"    active_js_urls.txt   ({n_active})")
+        log(f"    inactive_js_urls.txt ({n_inactive})")
+        log(f"    {args.csv} ({n_active + n_inactive} rows)")
+
+        if args.download and active:
+            log(f"\n[*] Downloading {len(active)} active files to: {args.outdir}")
+            # One directory listing up front instead of a stat() per file
+            os.makedirs(args.outdir, exist_ok=True)
+            with os.scandir(args.outdir) as it:
+                existing = {e.name for e in it}
+            for u, (res, err) in zip(active, ex.map(functools.partial(fetch, existing=existing), active)):
+                if err is None:
+                    path, size, ctype = res
+                    log(f"[DL] {u} -> {path} ({size} bytes, {ctype})")
+                else:
+                    log(f"[DL-FAIL] {u} -> {err}")
 
 
 if __name__ == "__main__":